@@ -0,0 +1,8 @@
+import pathlib
+import sys
+
+# The app modules are plain scripts, not a package.
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+
+# These are standalone scripts that hit the network, not pytest tests.
+collect_ignore_glob = ["test_bird*.py", "test_wheat_straw.py"]
@@ -0,0 +1,380 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from straw_images import (
+    DOWNLOAD_DIR, THUMB_DIR, create_thumbnail, download_one, safe_filename, search_image_urls,
+)
+
+logger = logging.getLogger(__name__)
+
+# -------------- Config --------------
+DB_PATH = DOWNLOAD_DIR / "jobs.sqlite3"
+MAX_WORKERS = 2
+HEARTBEAT_SECONDS = 10.0
+OWNER_TIMEOUT = 3 * HEARTBEAT_SECONDS
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+# ------------------------------------
+
+# Identifies this server process in the job table; pids alone can repeat across restarts.
+OWNER = f"{os.getpid()}:{uuid.uuid4().hex}"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_key     TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    params      TEXT NOT NULL,
+    out_dir     TEXT NOT NULL,
+    progress    REAL NOT NULL DEFAULT 0.0,
+    message     TEXT NOT NULL DEFAULT '',
+    result      TEXT,
+    error       TEXT,
+    owner       TEXT NOT NULL DEFAULT '',
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (job_key);
+CREATE TABLE IF NOT EXISTS owners (
+    owner       TEXT PRIMARY KEY,
+    seen_at     REAL NOT NULL
+);
+"""
+
+
+def connect(db_path: pathlib.Path) -> sqlite3.Connection:
+    """Open the job table. Each process/thread opens its own short-lived connection."""
+    db_path = pathlib.Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30.0, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def job_key(params: dict) -> str:
+    """Stable key for a job, so identical requests share one job."""
+    blob = json.dumps(params, sort_keys=True)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def update_job(db_path: pathlib.Path, job_id: int, **fields):
+    fields["updated_at"] = time.time()
+    cols = ", ".join(f"{k} = ?" for k in fields)
+    conn = connect(db_path)
+    try:
+        conn.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+    finally:
+        conn.close()
+
+
+def touch_owner(db_path: pathlib.Path, owner: str = OWNER):
+    """Record that `owner` is still alive."""
+    conn = connect(db_path)
+    try:
+        conn.execute("INSERT OR REPLACE INTO owners (owner, seen_at) VALUES (?, ?)", (owner, time.time()))
+    finally:
+        conn.close()
+
+
+def fail_orphaned_jobs(db_path: pathlib.Path):
+    """Fail active jobs whose server process stopped heartbeating; nothing will finish them now."""
+    cutoff = time.time() - OWNER_TIMEOUT
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE status IN (?, ?) "
+            "AND owner NOT IN (SELECT owner FROM owners WHERE seen_at >= ?)",
+            (FAILED, "Interrupted: the server running this job stopped.", time.time(),
+             *ACTIVE_STATES, cutoff),
+        )
+        conn.execute("DELETE FROM owners WHERE seen_at < ?", (cutoff,))
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+_heartbeats = {}  # db path -> {"stop": Event, "users": number of open queues}
+_heartbeats_lock = threading.Lock()
+
+
+def _start_heartbeat(db_path: pathlib.Path):
+    """Keep this process marked alive and sweep up other processes' orphaned jobs, once per database."""
+    with _heartbeats_lock:
+        entry = _heartbeats.get(db_path)
+        if entry is not None:
+            entry["users"] += 1
+            return
+        entry = _heartbeats[db_path] = {"stop": threading.Event(), "users": 1}
+
+    def beat():
+        try:
+            while not entry["stop"].wait(HEARTBEAT_SECONDS):
+                try:
+                    touch_owner(db_path)
+                    fail_orphaned_jobs(db_path)
+                except Exception:
+                    # Keep beating: if this thread died, other servers would fail our running jobs.
+                    logger.exception("Job queue heartbeat for %s failed", db_path)
+        finally:
+            # Let the next JobQueue restart the heartbeat should this thread ever exit.
+            with _heartbeats_lock:
+                if _heartbeats.get(db_path) is entry:
+                    del _heartbeats[db_path]
+
+    threading.Thread(target=beat, name="job-queue-heartbeat", daemon=True).start()
+
+
+def _stop_heartbeat(db_path: pathlib.Path):
+    """Release one queue's use of the heartbeat; the last one to go stops the thread."""
+    with _heartbeats_lock:
+        entry = _heartbeats.get(db_path)
+        if entry is None:
+            return
+        entry["users"] -= 1
+        if entry["users"] <= 0:
+            entry["stop"].set()
+            del _heartbeats[db_path]
+
+
+def run_search_job(db_path: pathlib.Path, job_id: int, params: dict):
+    """Worker entry point: search, download, thumbnail and zip, reporting progress to the job table."""
+    try:
+        update_job(db_path, job_id, status=RUNNING, message="Searching images…")
+        urls = search_image_urls(params["query"], params["n_images"])
+        if not urls:
+            update_job(
+                db_path, job_id, status=FAILED,
+                error="No results returned. Try reducing the image count, changing the query, "
+                      "or running again (DDG can rate-limit).",
+            )
+            return
+
+        out_dir = DOWNLOAD_DIR / params["subdir"]
+        thumb_dir = THUMB_DIR / params["subdir"]
+        thumb_dir.mkdir(parents=True, exist_ok=True)
+        images = []
+        errors = []
+        for i, url in enumerate(urls, start=1):
+            update_job(
+                db_path, job_id,
+                progress=(i - 1) / len(urls),
+                message=f"Downloading image {i}/{len(urls)}…",
+            )
+            fname = safe_filename(url, i, params["straw_type"])
+            try:
+                p = download_one(url, out_dir, fname)
+            except Exception as e:
+                errors.append((url, str(e)))
+                continue
+            thumb = None
+            try:
+                thumb_path = thumb_dir / (p.stem + ".jpg")
+                create_thumbnail(p).save(thumb_path, "JPEG")
+                thumb = thumb_path.as_posix()
+            except Exception as e:
+                errors.append((p.name, f"thumbnail failed: {e}"))
+            images.append({"path": p.as_posix(), "thumb": thumb})
+
+        if not images:
+            update_job(
+                db_path, job_id, status=FAILED, progress=1.0, result=json.dumps({"errors": errors}),
+                error="All downloads failed. Try again (DuckDuckGo sometimes rate-limits).",
+            )
+            return
+
+        update_job(db_path, job_id, progress=1.0, message="Zipping images…")
+        # Only this job's files: the folder may still hold extras from an earlier, larger run.
+        zip_path = DOWNLOAD_DIR / f"{params['subdir']}.zip"
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+            for img in images:
+                zf.write(img["path"], arcname=pathlib.Path(img["path"]).name)
+
+        result = {
+            "urls": urls,
+            "out_dir": out_dir.as_posix(),
+            "images": images,
+            "errors": errors,
+            "zip": zip_path.as_posix(),
+        }
+        update_job(db_path, job_id, status=DONE, message="Done.", result=json.dumps(result))
+    except Exception as e:
+        update_job(db_path, job_id, status=FAILED, error=str(e))
+
+
+def _files_exist(result: dict) -> bool:
+    """True if a finished job's downloads are still on disk (folders can be deleted by hand)."""
+    return pathlib.Path(result["zip"]).exists() and all(
+        pathlib.Path(img["path"]).exists() for img in result["images"]
+    )
+
+
+class JobQueue:
+    """A local process pool fed from a SQLite job table.
+
+    Jobs are keyed by their parameters: submitting a request that matches a
+    queued, running or finished job returns that job instead of starting a new
+    one, so several sessions can share the same work.
+    """
+
+    def __init__(self, db_path: pathlib.Path = DB_PATH, max_workers: int = MAX_WORKERS, worker=run_search_job):
+        self.db_path = pathlib.Path(db_path)
+        self.max_workers = max_workers
+        # Must be a module-level function: it is pickled by name into the spawned workers.
+        self.worker = worker
+        self._lock = threading.Lock()
+        self._closed = False
+        self.pool = self._new_pool()
+        touch_owner(self.db_path)
+        fail_orphaned_jobs(self.db_path)
+        _start_heartbeat(self.db_path)
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # spawn rather than fork: the Streamlit server is multi-threaded.
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def close(self):
+        """Stop taking work. Jobs already handed to the pool still run to completion."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self.pool.shutdown(wait=False)
+        _stop_heartbeat(self.db_path)
+
+    def submit(self, params: dict, force: bool = False) -> int:
+        """Return the id of a job for `params`, starting one only if no reusable job exists."""
+        key = job_key(params)
+        out_dir = params["subdir"]
+        conn = connect(self.db_path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id, status, result FROM jobs WHERE job_key = ? AND status != ? "
+                    "ORDER BY id DESC LIMIT 1",
+                    (key, FAILED),
+                ).fetchone()
+                if row and row["status"] in ACTIVE_STATES:
+                    conn.execute("COMMIT")
+                    return row["id"]
+                if row and not force and _files_exist(json.loads(row["result"])):
+                    conn.execute("COMMIT")
+                    return row["id"]
+
+                clash = conn.execute(
+                    "SELECT id FROM jobs WHERE out_dir = ? AND job_key != ? AND status IN (?, ?)",
+                    (out_dir, key, *ACTIVE_STATES),
+                ).fetchone()
+                if clash:
+                    raise ValueError(
+                        f"Folder `{out_dir}` is already being filled by job #{clash['id']}. "
+                        "Wait for it to finish or choose another folder."
+                    )
+
+                now = time.time()
+                cur = conn.execute(
+                    "INSERT INTO jobs (job_key, status, params, out_dir, message, owner, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, QUEUED, json.dumps(params), out_dir, "Queued…", OWNER, now, now),
+                )
+                job_id = cur.lastrowid
+                # The new job overwrites this folder, so earlier results for it can't be reused.
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated_at = ? "
+                    "WHERE out_dir = ? AND status = ? AND id != ?",
+                    (
+                        FAILED,
+                        f"Files in folder `{out_dir}` were replaced by job #{job_id}. Run the search again.",
+                        now, out_dir, DONE, job_id,
+                    ),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+        self._start(job_id, params)
+        return job_id
+
+    def _start(self, job_id: int, params: dict):
+        """Hand a queued job to the pool. Failures are recorded on the job row, never raised."""
+        try:
+            with self._lock:
+                try:
+                    future = self.pool.submit(self.worker, self.db_path, job_id, params)
+                except BrokenProcessPool:
+                    # A worker died abruptly earlier; the executor refuses all work from then on.
+                    self.pool.shutdown(wait=False)
+                    self.pool = self._new_pool()
+                    future = self.pool.submit(self.worker, self.db_path, job_id, params)
+        except Exception as e:
+            update_job(self.db_path, job_id, status=FAILED, error=f"Could not start job: {e}")
+            return
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+
+    def _on_done(self, job_id: int, future):
+        # The worker records its own failures; this only catches a crashed/broken worker process.
+        if future.cancelled():
+            update_job(self.db_path, job_id, status=FAILED, error="Job was cancelled.")
+            return
+        exc = future.exception()
+        if exc is not None:
+            update_job(self.db_path, job_id, status=FAILED, error=f"Worker crashed: {exc}")
+
+    def get(self, job_id: int):
+        """Return the job as a dict (with `params`/`result` decoded), or None if unknown."""
+        conn = connect(self.db_path)
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def clear_finished(self):
+        """Forget finished and failed jobs so the next identical request runs again."""
+        conn = connect(self.db_path)
+        try:
+            conn.execute("DELETE FROM jobs WHERE status IN (?, ?)", (DONE, FAILED))
+        finally:
+            conn.close()
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def open_queue(db_path: pathlib.Path = DB_PATH, max_workers: int = MAX_WORKERS) -> JobQueue:
+    """Create this process's queue for `db_path`, closing the one it replaces (e.g. after a cache clear)."""
+    db_path = pathlib.Path(db_path)
+    queue = JobQueue(db_path, max_workers)
+    with _queues_lock:
+        old = _queues.get(db_path)
+        _queues[db_path] = queue
+    if old is not None:
+        old.close()
+    return queue
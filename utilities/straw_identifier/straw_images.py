@@ -0,0 +1,57 @@
+import pathlib
+import time
+
+from ddgs import DDGS
+from fastdownload import download_url
+from PIL import Image
+
+# -------------- Config --------------
+DOWNLOAD_DIR = pathlib.Path("downloads")
+THUMB_DIR = DOWNLOAD_DIR / ".thumbs"
+THUMB_SIZE = (256, 256)
+
+# ------------------------------------
+
+
+def search_image_urls(query: str, max_images: int, retries: int = 4, delay: float = 2.0):
+    """Return a list of image URLs using ddgs, with simple retry/backoff."""
+    urls = []
+    for attempt in range(1, retries + 1):
+        try:
+            with DDGS() as ddgs:
+                # safesearch: "off" | "moderate" | "strict"
+                results = ddgs.images(query, max_results=max_images, safesearch="moderate")
+                urls = [r.get("image") for r in results if r.get("image")]
+                if urls:
+                    break
+        except Exception as e:
+            if attempt == retries:
+                raise
+            time.sleep(delay * attempt)
+    return urls[:max_images]
+
+
+def safe_filename(url: str, idx: int, straw_type: str) -> str:
+    """Create a consistent local filename from URL."""
+    stem = f"{straw_type}_straw_{idx:03d}"
+    ext = ".jpg"
+    # try to infer extension from url
+    for cand in [".jpg", ".jpeg", ".png", ".webp"]:
+        if cand in url.lower():
+            ext = ".jpg" if cand in (".jpg", ".jpeg") else cand
+            break
+    return stem + ext
+
+
+def create_thumbnail(image_path: pathlib.Path, thumb_size=THUMB_SIZE) -> Image.Image:
+    with Image.open(image_path) as im:
+        im = im.convert("RGB")
+        im.thumbnail(thumb_size)
+        return im.copy()
+
+
+def download_one(url: str, out_dir: pathlib.Path, filename: str) -> pathlib.Path:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    target = out_dir / filename
+    download_url(url, target, show_progress=False)
+    return target
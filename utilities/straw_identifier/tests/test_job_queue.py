@@ -0,0 +1,206 @@
+import json
+import os
+import pathlib
+import sqlite3
+import time
+import zipfile
+
+import pytest
+
+import job_queue
+from job_queue import DONE, FAILED, OWNER, JobQueue, connect, fail_orphaned_jobs, open_queue
+
+GATE = pathlib.Path("gate")  # relative to the test's cwd, which spawned workers inherit
+
+
+class FakeThumb:
+    def save(self, path, fmt):
+        pathlib.Path(path).write_bytes(b"thumb")
+
+
+def fake_download(url, out_dir, filename):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    target = out_dir / filename
+    target.write_text(url)
+    return target
+
+
+def stub_worker(db_path, job_id, params):
+    """Runs in the spawned worker: the real pipeline with the network helpers replaced."""
+    job_queue.search_image_urls = lambda query, n: [f"http://example.com/{query}/{i}.jpg" for i in range(n)]
+    job_queue.download_one = fake_download
+    job_queue.create_thumbnail = lambda path: FakeThumb()
+    job_queue.run_search_job(db_path, job_id, params)
+
+
+def gated_worker(db_path, job_id, params):
+    while not GATE.exists():
+        time.sleep(0.05)
+    stub_worker(db_path, job_id, params)
+
+
+def crashing_worker(db_path, job_id, params):
+    os._exit(1)
+
+
+def make_params(query="a", subdir="w", n_images=3):
+    return {"straw_type": "wheat", "query": query, "n_images": n_images, "subdir": subdir}
+
+
+def wait(queue, job_id, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in (DONE, FAILED):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} still {job['status']}")
+
+
+@pytest.fixture(autouse=True)
+def fresh_registries(monkeypatch):
+    # Keep queues and heartbeats from one test out of the module-level state seen by the next.
+    monkeypatch.setattr(job_queue, "_queues", {})
+    monkeypatch.setattr(job_queue, "_heartbeats", {})
+
+
+@pytest.fixture
+def make_queue(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queues = []
+
+    def make(worker=stub_worker):
+        queue = JobQueue(tmp_path / "jobs.sqlite3", max_workers=2, worker=worker)
+        queues.append(queue)
+        return queue
+
+    yield make
+    GATE.touch()
+    for queue in queues:
+        queue.close()
+        queue.pool.shutdown(wait=True)
+    assert job_queue._heartbeats == {}
+
+
+def test_identical_requests_share_one_job(make_queue):
+    queue = make_queue()
+    job_id = queue.submit(make_params())
+    assert queue.submit(make_params()) == job_id
+
+    job = wait(queue, job_id)
+    assert job["status"] == DONE
+    assert len(job["result"]["images"]) == 3
+    assert queue.submit(make_params()) == job_id
+
+
+def test_force_reruns_a_finished_job(make_queue):
+    queue = make_queue()
+    job_id = queue.submit(make_params())
+    wait(queue, job_id)
+
+    new_id = queue.submit(make_params(), force=True)
+    assert new_id != job_id
+    assert wait(queue, new_id)["status"] == DONE
+
+
+def test_finished_job_is_rerun_when_its_files_are_gone(make_queue):
+    queue = make_queue()
+    job_id = queue.submit(make_params())
+    job = wait(queue, job_id)
+
+    pathlib.Path(job["result"]["zip"]).unlink()
+    assert queue.submit(make_params()) != job_id
+
+
+def test_second_query_into_a_busy_folder_is_rejected(make_queue):
+    queue = make_queue(worker=gated_worker)
+    job_id = queue.submit(make_params(query="a"))
+
+    with pytest.raises(ValueError, match="already being filled"):
+        queue.submit(make_params(query="b"))
+
+    GATE.touch()
+    assert wait(queue, job_id)["status"] == DONE
+
+
+def test_overwriting_a_folder_invalidates_its_finished_job(make_queue):
+    queue = make_queue()
+    a_id = queue.submit(make_params(query="a", n_images=3))
+    wait(queue, a_id)
+    b_id = queue.submit(make_params(query="b", n_images=2))
+    b = wait(queue, b_id)
+
+    a = queue.get(a_id)
+    assert a["status"] == FAILED
+    assert f"job #{b_id}" in a["error"]
+    assert queue.submit(make_params(query="a", n_images=3)) not in (a_id, b_id)
+
+    # B's ZIP holds only B's downloads, not the third file left over from A.
+    with zipfile.ZipFile(b["result"]["zip"]) as zf:
+        assert sorted(zf.namelist()) == sorted(pathlib.Path(i["path"]).name for i in b["result"]["images"])
+
+
+def test_dead_worker_does_not_break_the_queue(make_queue):
+    queue = make_queue(worker=crashing_worker)
+    job_id = queue.submit(make_params())
+    job = wait(queue, job_id)
+    assert job["status"] == FAILED
+    assert "Worker crashed" in job["error"]
+
+    queue.worker = stub_worker
+    new_id = queue.submit(make_params())
+    assert new_id != job_id
+    assert wait(queue, new_id)["status"] == DONE
+
+
+def test_replacing_the_queue_lets_running_jobs_finish(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db_path = tmp_path / "jobs.sqlite3"
+    first = open_queue(db_path)
+    first.worker = gated_worker
+    job_id = first.submit(make_params())
+
+    second = open_queue(db_path)
+    try:
+        assert second.get(job_id)["status"] != FAILED
+        assert db_path in job_queue._heartbeats  # closing `first` left the shared heartbeat running
+        GATE.touch()
+        assert wait(second, job_id)["status"] == DONE
+    finally:
+        second.close()
+        first.pool.shutdown(wait=True)
+        second.pool.shutdown(wait=True)
+    assert job_queue._heartbeats == {}
+
+
+def test_only_jobs_of_stale_owners_are_failed(tmp_path):
+    db_path = tmp_path / "jobs.sqlite3"
+    now = time.time()
+    conn = connect(db_path)
+    try:
+        conn.executemany(
+            "INSERT INTO owners (owner, seen_at) VALUES (?, ?)",
+            [(OWNER, now), ("other-live", now), ("other-dead", now - 2 * job_queue.OWNER_TIMEOUT)],
+        )
+        for owner in (OWNER, "other-live", "other-dead", "never-seen"):
+            conn.execute(
+                "INSERT INTO jobs (job_key, status, params, out_dir, owner, created_at, updated_at) "
+                "VALUES (?, 'running', ?, 'w', ?, ?, ?)",
+                (owner, json.dumps(make_params()), owner, now, now),
+            )
+    finally:
+        conn.close()
+
+    fail_orphaned_jobs(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        status = dict(conn.execute("SELECT owner, status FROM jobs"))
+    finally:
+        conn.close()
+    assert status == {
+        OWNER: "running",
+        "other-live": "running",
+        "other-dead": FAILED,
+        "never-seen": FAILED,
+    }